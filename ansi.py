@@ -0,0 +1,35 @@
+"""Precomputed ANSI escape sequences for terminal colors and styles."""
+import os
+import sys
+
+
+def _can_colorize() -> bool:
+    """Whether to emit colors, following the same rules termcolor did."""
+    if 'ANSI_COLORS_DISABLED' in os.environ or 'NO_COLOR' in os.environ:
+        return False
+    if 'FORCE_COLOR' in os.environ:
+        return True
+    return sys.stdout.isatty()
+
+
+# Every sequence is empty when output isn't a color terminal
+_ENABLED = _can_colorize()
+
+
+def _sgr(code: str) -> str:
+    return f'\x1b[{code}m' if _ENABLED else ''
+
+
+RESET = _sgr('0')
+
+BOLD = _sgr('1')
+DARK = _sgr('2')
+UNDERLINE = _sgr('4')
+
+RED = _sgr('31')
+GREEN = _sgr('32')
+YELLOW = _sgr('33')
+BLUE = _sgr('34')
+WHITE = _sgr('97')
+
+ON_GREY = _sgr('40')
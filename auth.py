@@ -1,5 +1,9 @@
 import os
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import anthropic
 
 def get_api_key() -> Optional[str]:
     api_key = os.getenv('ANTHROPIC_API_KEY')
@@ -8,3 +12,10 @@ def get_api_key() -> Optional[str]:
         print("Please set it with: export ANTHROPIC_API_KEY='your-api-key'")
         return None
     return api_key
+
+
+@lru_cache(maxsize=1)
+def get_client(api_key: str) -> "anthropic.Anthropic":
+    """Return a shared Anthropic client so every request reuses its connection pool."""
+    import anthropic
+    return anthropic.Anthropic(api_key=api_key)
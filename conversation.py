@@ -1,73 +1,253 @@
+import atexit
 import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime as dt
-from termcolor import colored
+from ansi import BLUE, BOLD, GREEN, RED, RESET, WHITE, YELLOW
 from text_formatter import TextFormatter
-from progress_tracker import ProgressTracker, render_text_smoothly
+from progress_tracker import replace_streamed_text, stream_response
 from model_selector import ModelSelector
 
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+# Conversations shorter than this are always summarized locally
+SUMMARY_API_MIN_MESSAGES = 10
+
+_WORD_RE = re.compile(r"[A-Za-z]{3,}")
+_STOPWORDS = frozenset("""
+    about above after again all also and any are because been before being
+    below between both but can could did does doing down during each few for
+    from further had has have having her here hers him his how into its just
+    like more most not now off once only other our ours out over own please
+    same she should some such than that the their theirs them then there
+    these they this those through too under until use used using very was
+    way were what when where which while who whom why will with would you
+    your yours yourself
+""".split())
+
+
+def with_cache_breakpoint(messages: list) -> list:
+    """Return a copy of messages that marks everything up to the last one as cacheable."""
+    if not messages:
+        return messages
+    last = messages[-1]
+    return messages[:-1] + [{
+        "role": last["role"],
+        "content": [{
+            "type": "text",
+            "text": last["content"],
+            "cache_control": {"type": "ephemeral"}
+        }]
+    }]
+
+
+# Transcript writes happen in the background, in submission order; pending
+# writes finish before exit
+_writer = ThreadPoolExecutor(max_workers=1)
+atexit.register(_writer.shutdown, wait=True)
+
+
+def _write_to(fd: int, content: str) -> None:
+    data = memoryview(content.encode('utf-8'))
+    # os.write may write less than asked, so keep going until it's all out
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _append_file(path: str, content: str) -> None:
+    """Append content to path, creating it if needed."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        _write_to(fd, content)
+    finally:
+        os.close(fd)
+
+
+def _write_file(path: str, content: str) -> None:
+    """Replace path with content and flush it to disk."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _write_to(fd, content)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sync_file(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _format_entry(message: dict, first: bool) -> str:
+    role = "You" if message["role"] == "user" else "Claude"
+    separator = "" if first else "\n"
+    return f"{separator}{role}: {message['content']}\n"
+
+
+def _report_write_error(future: Future) -> None:
+    if future.exception():
+        print(f"{RED}\nError saving conversation: {future.exception()}{RESET}")
+
+
+# httpx closes a pooled connection after 5s idle, so refresh it a little sooner
+_WARM_UP_INTERVAL = 4.0
+# Stop refreshing once the user has been away this long
+_WARM_UP_LIMIT = 60.0
+
+
+def _warm_connection(client) -> None:
+    """Touch the API host so the pooled connection is fresh for the next turn."""
+    try:
+        # The SDK has no public way to reach its httpx client, so this relies
+        # on the private _client attribute; any failure just skips the warm-up
+        client._client.head("/")
+    except Exception:
+        pass
+
+
+def _keep_connection_warm(client, stop: threading.Event) -> None:
+    """Refresh the pooled connection until stopped or _WARM_UP_LIMIT has passed."""
+    deadline = time.monotonic() + _WARM_UP_LIMIT
+    while not stop.wait(_WARM_UP_INTERVAL) and time.monotonic() < deadline:
+        _warm_connection(client)
+
 
 class ConversationManager:
-    def __init__(self, client, messages=None):
+    def __init__(self, client, messages=None, ai_summary: bool = False):
         self.client = client
         self.messages = messages or []
+        self.ai_summary = ai_summary
         self.formatter = TextFormatter()
+        # Model answering the conversation, once handle_conversation starts
+        self.model = None
 
-    def handle_conversation(self, model: str, max_tokens: int, concise: bool, short: bool, no_animation: bool = True) -> None:
-        print(colored(
-            "\nConversation started. Enter 'exit' or 'quit' at any time to end the conversation.", "white"))
+        # Each message is appended to a session log as it is added, so saving
+        # is a rename rather than a rewrite of the whole conversation. The log
+        # and its methods below are only touched on the writer thread. If an
+        # append fails, saving writes the transcript out in full instead; an
+        # unsaved log is removed on exit, unless a save of it failed
+        self._session_log = f"history/.session-{uuid.uuid4().hex[:8]}.log"
+        self._log_path = self._session_log
+        self._log_failed = False
+        self._keep_log = False
+        self._made_history = False
+        self._logged = 0
+        atexit.register(self._on_exit)
+        for message in self.messages:
+            self._log_message(message)
 
+    def add_message(self, role: str, content: str) -> None:
+        """Add a message to the conversation and its transcript."""
+        message = {"role": role, "content": content}
+        self.messages.append(message)
+        self._log_message(message)
+
+    def _log_message(self, message: dict) -> None:
+        entry = _format_entry(message, first=not self._logged)
+        self._logged += 1
+        _writer.submit(self._append_entry, entry)
+
+    def _append_entry(self, entry: str) -> None:
+        if self._log_failed:
+            return
+        try:
+            if not os.path.isdir('history'):
+                os.makedirs('history', exist_ok=True)
+                self._made_history = True
+            _append_file(self._log_path, entry)
+        except OSError:
+            # Reported only if the user saves, which then rewrites the transcript
+            self._log_failed = True
+
+    def _save_log(self, filename: str, messages: list) -> None:
+        try:
+            if self._log_failed:
+                os.makedirs('history', exist_ok=True)
+                _write_file(filename, ''.join(
+                    _format_entry(message, first=i == 0)
+                    for i, message in enumerate(messages)))
+                self._discard_log()
+            else:
+                _sync_file(self._log_path)
+                os.rename(self._log_path, filename)
+        except OSError as e:
+            self._keep_log = True
+            if os.path.exists(self._log_path):
+                raise OSError(f"{e} (transcript kept in {self._log_path})") from e
+            raise
+        self._log_path = filename
+        self._log_failed = False
+
+    def _on_exit(self) -> None:
+        # Let pending appends and saves finish before deciding what to remove
+        _writer.shutdown(wait=True)
+        self._discard_log()
+
+    def _discard_log(self) -> None:
+        if self._keep_log or self._log_path != self._session_log:
+            return
+        try:
+            os.remove(self._session_log)
+            if self._made_history:
+                os.rmdir('history')
+        except OSError:
+            pass
+
+    def handle_conversation(self, model: str, max_tokens: int, concise: bool, short: bool, typewriter: bool = False) -> None:
+        self.model = model
+        print(f"{WHITE}\nConversation started. Enter 'exit' or 'quit' at any time to end the conversation.{RESET}")
+
+        warm_up = None
         while True:
-            user_input = input(colored("\nYou: ", "blue", attrs=["bold"]))
+            user_input = input(f"{BOLD}{BLUE}\nYou: {RESET}")
+            if warm_up:
+                warm_up.set()
 
             if user_input.lower() in ['exit', 'quit']:
-                print(colored("\nEnding conversation.", "yellow"))
+                print(f"{YELLOW}\nEnding conversation.{RESET}")
                 save_prompt = input(
-                    colored("Do you want to save this conversation? (y/n): ", "yellow"))
+                    f"{YELLOW}Do you want to save this conversation? (y/n): {RESET}")
                 if save_prompt.lower() == 'y':
                     self.save_conversation()
-                print(colored("Goodbye!", "yellow"))
+                print(f"{YELLOW}Goodbye!{RESET}")
                 break
 
             self.process_message(
-                user_input, model, max_tokens, concise, short, no_animation)
+                user_input, model, max_tokens, concise, short, typewriter)
 
-    def process_message(self, user_input: str, model: str, max_tokens: int, concise: bool, short: bool, no_animation: bool) -> None:
+            # Keep the pooled connection from expiring while the user types
+            # the next prompt; submitting it stops the refreshes
+            warm_up = threading.Event()
+            threading.Thread(target=_keep_connection_warm, args=(
+                self.client, warm_up), daemon=True).start()
+
+    def process_message(self, user_input: str, model: str, max_tokens: int, concise: bool, short: bool, typewriter: bool = False) -> None:
         try:
             modified_input = ModelSelector.modify_prompt(
                 user_input, concise, short)
-            self.messages.append({"role": "user", "content": user_input})
+            self.add_message("user", user_input)
 
             print("\n" + "=" * 50)
-            print(colored("CLAUDE'S RESPONSE", "green", attrs=[
-                  "bold"]) + colored(":", "white") + "\n")
-
-            if no_animation:
-                tracker = ProgressTracker()
-                tracker.start()
-
-            response = self.client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                messages=self.messages
-            )
+            print(f"{BOLD}{GREEN}CLAUDE'S RESPONSE{RESET}{WHITE}:{RESET}\n")
 
-            tracker.stop()
-            response_text = response.content[0].text
+            response_text = stream_response(
+                self.client, with_cache_breakpoint(self.messages), model,
+                max_tokens, extra_headers=PROMPT_CACHING_HEADERS)
 
             # Apply formatting
-            formatted_text = self.formatter.enhance_text_formatting(
-                response_text)
-            formatted_text = self.formatter.highlight_code_blocks(
-                formatted_text)
-            
-            # Render the response
-            if no_animation:
-                print(formatted_text)
-            else:
-                render_text_smoothly(formatted_text)
+            formatted_text = self.formatter.format_response(response_text)
 
-            self.messages.append(
-                {"role": "assistant", "content": response_text})
+            # Replace the raw streamed text with the formatted response
+            replace_streamed_text(response_text, formatted_text, typewriter)
+
+            self.add_message("assistant", response_text)
             print("=" * 50)
 
         except Exception as e:
@@ -75,17 +255,27 @@ class ConversationManager:
             raise
 
     def get_conversation_summary(self) -> str:
-        """Get a three word summary of the conversation using Claude."""
+        """Get a three word summary of the conversation, using Claude for long conversations when enabled."""
+        if not self.ai_summary or len(self.messages) < SUMMARY_API_MIN_MESSAGES:
+            return self.get_local_summary()
+
         try:
             summary_prompt = {
                 "role": "user",
                 "content": "Please provide a three-word summary of this conversation. Use hyphens between words and only alphanumeric characters. Example format: useful-python-discussion"
             }
 
+            # Caches are per model, so the prefix cached by the last turn can
+            # only be reused when the conversation was also with Haiku
+            messages = self.messages
+            if self.model == ModelSelector.HAIKU:
+                messages = with_cache_breakpoint(messages)
+
             response = self.client.messages.create(
                 model=ModelSelector.HAIKU,  # Use faster model for summary
                 max_tokens=30,
-                messages=self.messages + [summary_prompt]
+                messages=messages + [summary_prompt],
+                extra_headers=PROMPT_CACHING_HEADERS
             )
 
             summary = response.content[0].text.strip().lower()
@@ -95,23 +285,24 @@ class ConversationManager:
             print(f"Error getting summary: {e}")
             return "general-chat-log"
 
+    def get_local_summary(self) -> str:
+        """Get a three word summary from the most frequent words in the conversation."""
+        text = " ".join(msg["content"] for msg in self.messages)
+        counts = Counter(word for word in map(str.lower, _WORD_RE.findall(text))
+                         if word not in _STOPWORDS)
+        words = [word for word, _ in counts.most_common(3)]
+        return '-'.join(words) or "general-chat-log"
+
     def save_conversation(self) -> None:
         """Save the conversation to a file in the history folder."""
         try:
-            os.makedirs('history', exist_ok=True)
-
             summary = self.get_conversation_summary()
             timestamp = dt.now().strftime("%Y-%m-%d-%H:%M:%S")
             filename = f"history/{timestamp}-{summary}.txt"
 
-            content = []
-            for msg in self.messages:
-                role = "You" if msg["role"] == "user" else "Claude"
-                content.append(f"{role}: {msg['content']}\n")
-
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(content))
+            _writer.submit(self._save_log, filename, list(self.messages)).add_done_callback(
+                _report_write_error)
 
-            print(colored(f"\nConversation saved to: {filename}", "green"))
+            print(f"{GREEN}\nConversation saved to: {filename}{RESET}")
         except Exception as e:
-            print(colored(f"\nError saving conversation: {e}", "red"))
+            print(f"{RED}\nError saving conversation: {e}{RESET}")
@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
-import anthropic
 import argparse
-from termcolor import colored
-from auth import get_api_key
+import os
+from ansi import BLUE, BOLD, GREEN, RESET, WHITE, YELLOW
+from auth import get_api_key, get_client
 from model_selector import ModelSelector
-from conversation import ConversationManager
+from conversation import ConversationManager, PROMPT_CACHING_HEADERS, with_cache_breakpoint
 from text_formatter import TextFormatter
-from progress_tracker import ProgressTracker, render_text_smoothly
+from progress_tracker import replace_streamed_text, stream_response
 
 
 def setup_argument_parser() -> argparse.ArgumentParser:
@@ -18,17 +18,23 @@ def setup_argument_parser() -> argparse.ArgumentParser:
                         help='Format the response as an ordered list')
     parser.add_argument('-s', '--short', action='store_true',
                         help='Request a short response (paragraph or less)')
-    parser.add_argument('-na', '--no-animation', action='store_true',
-                        help='Animate the response as it is being printed')
+    # Both flags set args.typewriter; whichever comes last on the command line wins
+    parser.add_argument('--typewriter', action='store_true',
+                        help='Replay the formatted response with a typing animation (or set CLAUDE_ANIMATE=1)')
+    parser.add_argument('-na', '--no-animation', action='store_false', dest='typewriter',
+                        help='Disable the typing animation, overriding CLAUDE_ANIMATE')
+    parser.set_defaults(typewriter=os.getenv('CLAUDE_ANIMATE') == '1')
     parser.add_argument('--model', type=str,
                         help='The model to use (auto-selected based on query)')
+    parser.add_argument('--ai-summary', action='store_true',
+                        help='Summarize long conversations with Claude when saving')
     parser.add_argument('--max-tokens', type=int, default=1000,
                         help='Maximum number of tokens in response (default: 1000)')
     return parser
 
 
 def call_anthropic_api(prompt: str, args, api_key: str) -> None:
-    client = anthropic.Anthropic(api_key=api_key)
+    client = get_client(api_key)
     model = ModelSelector.select_model(prompt, args)
     formatter = TextFormatter()
 
@@ -36,48 +42,35 @@ def call_anthropic_api(prompt: str, args, api_key: str) -> None:
         modified_prompt = ModelSelector.modify_prompt(
             prompt, args.concise, args.short)
         messages = [{"role": "user", "content": modified_prompt}]
-        conversation = ConversationManager(client, messages)
+        conversation = ConversationManager(
+            client, messages, ai_summary=args.ai_summary)
 
         # Print the prompt section
         print("\n" + "=" * 50)
-        print(colored("PROMPT", "blue", attrs=[
-              "bold"]) + colored(":", "white") + "\n")
-        print(colored(modified_prompt, "white"))
+        print(f"{BOLD}{BLUE}PROMPT{RESET}{WHITE}:{RESET}\n")
+        print(f"{WHITE}{modified_prompt}{RESET}")
         print("\n" + "=" * 50)
-        print(colored("CLAUDE'S RESPONSE", "green", attrs=[
-              "bold"]) + colored(":", "white") + "\n")
+        print(f"{BOLD}{GREEN}CLAUDE'S RESPONSE{RESET}{WHITE}:{RESET}\n")
 
-        # Use progress tracking for the response
-        tracker = ProgressTracker()
-        tracker.start()
-
-        response = client.messages.create(
-            model=model,
-            max_tokens=args.max_tokens,
-            messages=messages
-        )
-
-        tracker.stop()
-        response_text = response.content[0].text
+        response_text = stream_response(
+            client, with_cache_breakpoint(messages), model, args.max_tokens,
+            extra_headers=PROMPT_CACHING_HEADERS)
 
         # Apply formatting
-        formatted_text = formatter.enhance_text_formatting(response_text)
-        formatted_text = formatter.highlight_code_blocks(formatted_text)
+        formatted_text = formatter.format_response(response_text)
 
-        # Render the response
-        if args.no_animation:
-            print(formatted_text)
-        else:
-            render_text_smoothly(formatted_text)
+        # Replace the raw streamed text with the formatted response
+        replace_streamed_text(response_text, formatted_text, args.typewriter)
 
-        messages.append({"role": "assistant", "content": response_text})
+        conversation.add_message("assistant", response_text)
         print("=" * 50 + "\n")
 
         should_continue = input(
-            colored("Would you like to continue the conversation? (y/n): ", "yellow"))
+            f"{YELLOW}Would you like to continue the conversation? (y/n): {RESET}")
         if should_continue.lower() == 'y':
             conversation.handle_conversation(
-                model, args.max_tokens, args.concise, args.short)
+                model, args.max_tokens, args.concise, args.short,
+                args.typewriter)
 
     except Exception as e:
         print(f"Unexpected error: {e}")
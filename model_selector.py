@@ -1,3 +1,18 @@
+def _word_count_at_least(text: str, n: int) -> bool:
+    """Check whether text has at least n words, stopping as soon as it does."""
+    count = 0
+    in_word = False
+    for char in text:
+        if char.isspace():
+            in_word = False
+        elif not in_word:
+            count += 1
+            if count >= n:
+                return True
+            in_word = True
+    return False
+
+
 class ModelSelector:
     HAIKU = 'claude-3-haiku-20240307'
     SONNET = 'claude-3-sonnet-20240229'
@@ -10,7 +25,7 @@ class ModelSelector:
             return args.model
 
         # Use Haiku for short/simple queries
-        if args.short or len(prompt.split()) < 20:
+        if args.short or not _word_count_at_least(prompt, 20):
             return ModelSelector.HAIKU
 
         # Default to Sonnet for medium complexity
@@ -1,8 +1,23 @@
 import threading
-import itertools
+import shutil
+import math
+import queue
+import re
 import time
 import sys
-import anthropic
+import unicodedata
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import anthropic
+
+# Seconds without a new token before a stream is treated as stalled
+STREAM_TIMEOUT = 30
+# Seconds between spinner frames while waiting for the first token
+SPINNER_INTERVAL = 0.1
+_STREAM_END = object()
+# A word with its surrounding whitespace, or a run of whitespace on its own
+_WORD_RE = re.compile(r'\s*\S+\s*|\s+')
 
 class ProgressTracker:
     def __init__(self):
@@ -10,50 +25,122 @@ class ProgressTracker:
         self.elapsed_time = 0
         self.spinner_chars = ['⣾', '⣽', '⣻', '⢿', '⡿', '⣟', '⣯', '⣷']
         self.response_text = ""
-        self.printed_chars = 0
+        self._start_time = time.monotonic()
+        self._frame = -1
 
     def start(self):
         """Start the progress tracking animation"""
+        # The spinner redraws itself with carriage returns, which only make
+        # sense on a terminal; elsewhere tick() and stop() have nothing to do
+        if not sys.stdout.isatty():
+            self.done = True
+            return
         self.done = False
         self.elapsed_time = 0
+        self._start_time = time.monotonic()
+        self._frame = -1
+        self.tick()
 
-        # Start spinner and timer thread
-        threading.Thread(target=self._animate, daemon=True).start()
+    def tick(self):
+        """Draw the spinner and timer, if either has changed since the last frame"""
+        if self.done:
+            return
+        elapsed = time.monotonic() - self._start_time
+        frame = int(elapsed / SPINNER_INTERVAL)
+        if frame == self._frame:
+            return
+        self._frame = frame
+        self.elapsed_time = int(elapsed)
+        spinner_char = self.spinner_chars[frame % len(self.spinner_chars)]
+        sys.stdout.write(
+            f'\rClaude is thinking {spinner_char} {self.elapsed_time}s')
+        sys.stdout.flush()
 
     def stop(self):
         """Stop the animation"""
+        if self.done:
+            return
         self.done = True
-        # Clear the line and move cursor to start
-        sys.stdout.write('\r' + ' ' * 50 + '\r')
+        # Move cursor to start and erase the whole line, however long it got
+        sys.stdout.write('\r\x1b[2K')
         sys.stdout.flush()
 
-    def _animate(self):
-        """Animate the spinner and timer"""
-        spinner = itertools.cycle(self.spinner_chars)
-        start_time = time.time()
-
-        while not self.done:
-            self.elapsed_time = int(time.time() - start_time)
-            spinner_char = next(spinner)
-            sys.stdout.write(
-                f'\rClaude is thinking {spinner_char} {self.elapsed_time}s')
-            sys.stdout.flush()
-            time.sleep(0.1)
-
 
 def render_text_smoothly(text: str, delay: float = 0.0015):
-    """Render text with a smooth typing animation"""
-    for char in text:
-        sys.stdout.write(char)
+    """Render text with a smooth typing animation, one word at a time"""
+    for match in _WORD_RE.finditer(text):
+        word = match.group()
+        sys.stdout.write(word)
         sys.stdout.flush()
-        time.sleep(delay)
+        time.sleep(delay * len(word))
     sys.stdout.write('\n')
 
-# Modified stream_response function to use the progress tracker
+def _display_width(line: str) -> int:
+    """Number of terminal columns a line of text occupies"""
+    width = 0
+    for char in line:
+        if char == '\t':
+            width += 8 - width % 8
+        elif unicodedata.combining(char) or unicodedata.category(char) in ('Mn', 'Me', 'Cf', 'Cc'):
+            continue
+        elif unicodedata.east_asian_width(char) in ('W', 'F'):
+            width += 2
+        else:
+            width += 1
+    return width
+
+
+def erase_text(text: str) -> bool:
+    """Erase text previously written to the terminal, leaving the cursor where it began.
+
+    Returns False, leaving the text alone, when part of it has scrolled off the
+    top of the screen where the cursor can no longer reach it.
+    """
+    size = shutil.get_terminal_size()
+    rows = sum(max(1, math.ceil(_display_width(line) / size.columns))
+               for line in text.split('\n'))
+    if rows > size.lines:
+        return False
+    sys.stdout.write('\r' + (f'\x1b[{rows - 1}A' if rows > 1 else '') + '\x1b[J')
+    sys.stdout.flush()
+    return True
+
 
+def replace_streamed_text(streamed: str, formatted: str, typewriter: bool = False) -> None:
+    """Replace the raw text shown while streaming with its formatted version"""
+    if not sys.stdout.isatty():
+        # Nothing was echoed while streaming, so the formatted text is all there is
+        print(formatted)
+        return
+    if formatted == streamed and not typewriter:
+        # Already on screen as it should look
+        sys.stdout.write('\n')
+        return
 
-async def stream_response(client: anthropic.Anthropic, messages: list, model: str, max_tokens: int) -> str:
-    """Stream the response from Claude and return the full response text."""
+    if not erase_text(streamed):
+        # Too tall to redraw in place, so show the formatted copy below the raw text
+        sys.stdout.write('\n\n')
+    if typewriter:
+        render_text_smoothly(formatted)
+    else:
+        print(formatted)
+
+
+def _pump_stream(stream, chunks: queue.Queue) -> None:
+    """Forward streamed text onto the queue, followed by any error and an end marker"""
+    try:
+        for text in stream.text_stream:
+            chunks.put(text)
+    except Exception as e:
+        chunks.put(e)
+    finally:
+        chunks.put(_STREAM_END)
+
+
+def stream_response(client: "anthropic.Anthropic", messages: list, model: str, max_tokens: int, extra_headers: Optional[dict] = None) -> str:
+    """Stream the response from Claude to the terminal and return the full response text."""
+    # Raw text is only echoed where replace_streamed_text can erase it again
+    echo = sys.stdout.isatty()
     full_response = []
     tracker = ProgressTracker()
     tracker.start()
@@ -62,15 +149,40 @@ async def stream_response(client: anthropic.Anthropic, messages: list, model: st
         with client.messages.stream(
             messages=messages,
             model=model,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            extra_headers=extra_headers
         ) as stream:
-            async for chunk in stream:
-                if chunk.type == "content_block_delta":
-                    text = chunk.delta.text
-                    full_response.append(text)
-                    render_text_smoothly(
-                        text[tracker.printed_chars:], delay=0.001)
-                    tracker.printed_chars = len(text)
+            # Iterate on a worker thread so a silently stalled connection
+            # can't block the terminal indefinitely; this thread animates the
+            # spinner between polls until the first token arrives
+            chunks = queue.Queue()
+            threading.Thread(target=_pump_stream, args=(
+                stream, chunks), daemon=True).start()
+
+            last_chunk_time = time.monotonic()
+            while True:
+                try:
+                    text = chunks.get(
+                        timeout=STREAM_TIMEOUT if full_response else SPINNER_INTERVAL)
+                except queue.Empty:
+                    if time.monotonic() - last_chunk_time >= STREAM_TIMEOUT:
+                        stream.close()
+                        raise TimeoutError(f"no tokens in {STREAM_TIMEOUT}s")
+                    tracker.tick()
+                    continue
+                last_chunk_time = time.monotonic()
+                if text is _STREAM_END:
+                    break
+                if isinstance(text, Exception):
+                    raise text
+
+                # The first token replaces the spinner as the progress signal
+                if not full_response:
+                    tracker.stop()
+                full_response.append(text)
+                if echo:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
     finally:
         tracker.stop()
 
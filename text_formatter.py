@@ -1,122 +1,202 @@
-from termcolor import colored
+from ansi import BLUE, BOLD, DARK, GREEN, ON_GREY, RESET, UNDERLINE, WHITE, YELLOW
 import re
-from pygments import highlight
-from pygments.formatters import TerminalFormatter
-from pygments.lexers import get_lexer_by_name, guess_lexer
-from pygments.util import ClassNotFound
+from functools import lru_cache
+from types import SimpleNamespace
+
+# Every markdown element formatted below contains at least one of these
+_MARKDOWN_HINT_RE = re.compile(r'[`*#\[•]|-\s|\d\.\s')
+# A numbered list item, bullet point, or header, matched against a single line
+_LINE_RE = re.compile(
+    r'(?:(?P<number>(?P<number_indent>\s*)(?P<number_marker>\d+\.)'
+    r'(?P<number_spacing>\s+)(?P<number_content>.+))'
+    r'|(?P<bullet>(?P<bullet_indent>\s*)[•\-\*]'
+    r'(?P<bullet_spacing>\s+)(?P<bullet_content>.+))'
+    r'|(?P<header>#{1,6}\s+(?P<header_content>.+)))$')
+# First non-blank characters that can start a line matched by _LINE_RE
+_LINE_STARTS = frozenset('0123456789•-*#')
+# Inline code, bold text, italics, and URLs, matched in one pass; bold comes
+# before italics so '**' isn't read as two single asterisks, and link text
+# can't contain '[' so a link never starts at an earlier color code
+_INLINE_RE = re.compile(
+    r'(?P<code>`(?P<code_content>[^`]+)`)'
+    r'|(?P<bold>\*\*(?P<bold_content>[^*]+)\*\*)'
+    r'|(?P<italic>\*(?P<italic_content>[^*]+)\*)'
+    r'|(?P<url>\[(?P<url_text>[^\[\]]+)\]\([^\)]+\))')
+
+# Combined escape sequences for each formatted element
+_MARKER_STYLE = BOLD + YELLOW
+_INLINE_CODE_STYLE = BOLD + ON_GREY + GREEN
+_LINK_STYLE = UNDERLINE + BLUE
+_HEADER_STYLE = BOLD + UNDERLINE + WHITE
+
+_pygments = None
+# guess_lexer only sees this much of a block, which also keys its cache
+_GUESS_PREFIX_LENGTH = 256
+# Opening text that identifies a language without trying every lexer
+_LEXER_HINTS = (
+    ('#!/usr/bin/env python', 'python'),
+    ('#!/usr/bin/python', 'python'),
+    ('#!/usr/bin/env bash', 'bash'),
+    ('#!/bin/bash', 'bash'),
+    ('#!/bin/sh', 'sh'),
+    ('<?xml', 'xml'),
+    ('<?php', 'php'),
+    ('<!DOCTYPE html', 'html'),
+    ('<!doctype html', 'html'),
+    ('<html', 'html'),
+)
+
+
+def _load_pygments() -> SimpleNamespace:
+    """Import Pygments on first use so startup doesn't pay for it."""
+    global _pygments
+    if _pygments is None:
+        from pygments import highlight
+        from pygments.formatters import TerminalFormatter
+        from pygments.lexers import get_lexer_by_name, guess_lexer
+        from pygments.util import ClassNotFound
+        _pygments = SimpleNamespace(
+            highlight=highlight,
+            formatter=TerminalFormatter(),
+            get_lexer_by_name=get_lexer_by_name,
+            guess_lexer=guess_lexer,
+            ClassNotFound=ClassNotFound)
+    return _pygments
+
+
+def _split_code_blocks(text: str) -> list:
+    """Split text into [prose, (language, code), prose, ..., prose].
+
+    Finds the same blocks as the pattern ```(\\w+)?\\n(.*?)\\n``` in one
+    left-to-right scan with str.find, without running the regex engine.
+    """
+    parts = []
+    start = search = 0
+    while True:
+        fence = text.find('```', search)
+        if fence < 0:
+            break
+        newline = text.find('\n', fence + 3)
+        if newline < 0:
+            break
+        language = text[fence + 3:newline]
+        if not all(char.isalnum() or char == '_' for char in language):
+            # Not an opening fence; a later backtick may still start one
+            search = fence + 1
+            continue
+        close = text.find('\n```', newline + 1)
+        if close < 0:
+            break
+        parts.append(text[start:fence])
+        parts.append((language, text[newline + 1:close]))
+        start = search = close + 4
+    parts.append(text[start:])
+    return parts
+
+
+@lru_cache(maxsize=64)
+def _lexer_by_name(language: str):
+    """Return the Pygments lexer for a language name, reusing earlier lookups."""
+    return _load_pygments().get_lexer_by_name(language)
+
+
+def _guess_lexer(code: str):
+    """Guess a Pygments lexer for code, reusing guesses for the same opening text."""
+    opening = code.lstrip()[:_GUESS_PREFIX_LENGTH]
+    for prefix, language in _LEXER_HINTS:
+        if opening.startswith(prefix):
+            return _lexer_by_name(language)
+    if opening.startswith(('{', '[')) and '":' in opening:
+        return _lexer_by_name('json')
+    return _guess_lexer_for_prefix(code[:_GUESS_PREFIX_LENGTH])
+
+
+@lru_cache(maxsize=64)
+def _guess_lexer_for_prefix(prefix: str):
+    return _load_pygments().guess_lexer(prefix)
+
+
+def _replace_line(match) -> str:
+    """Format a numbered list item, bullet point, or header matched by _LINE_RE."""
+    kind = match.lastgroup
+    if kind == 'number':
+        indent, number, spacing, content = match.group(
+            'number_indent', 'number_marker', 'number_spacing', 'number_content')
+        return f"{indent}{_MARKER_STYLE}{number}{RESET}{spacing}{WHITE}{content}{RESET}"
+    if kind == 'bullet':
+        indent, spacing, content = match.group(
+            'bullet_indent', 'bullet_spacing', 'bullet_content')
+        return f"{indent}{_MARKER_STYLE}•{RESET}{spacing}{WHITE}{content}{RESET}"
+    return f"\n{_HEADER_STYLE}{match.group('header_content')}{RESET}\n"
+
+
+def _replace_inline(match) -> str:
+    """Format an inline element matched by _INLINE_RE."""
+    kind = match.lastgroup
+    if kind == 'code':
+        return f"{_INLINE_CODE_STYLE}{match.group('code_content')}{RESET}"
+    if kind == 'bold':
+        return f"{BOLD}{match.group('bold_content')}{RESET}"
+    if kind == 'italic':
+        return f"{DARK}{match.group('italic_content')}{RESET}"
+    return f"{_LINK_STYLE}{match.group('url_text')}{RESET}"
 
 
 class TextFormatter:
     @staticmethod
-    def highlight_code_blocks(text: str) -> str:
-        """Highlight code blocks in the text using Pygments."""
-        pattern = r"```(\w+)?\n(.*?)\n```"
+    def format_response(text: str) -> str:
+        """Format prose and highlight code blocks in a single pass over the text."""
+        if '```' not in text:
+            return TextFormatter._format_prose(text)
 
-        def replace_code_block(match):
-            language = match.group(1) or ''
-            code = match.group(2)
+        parts = _split_code_blocks(text)
 
-            try:
-                if language:
-                    lexer = get_lexer_by_name(language)
-                else:
-                    lexer = guess_lexer(code)
-                return "\n" + highlight(code, lexer, TerminalFormatter()) + "\n"
-            except ClassNotFound:
-                try:
-                    lexer = guess_lexer(code)
-                    return "\n" + highlight(code, lexer, TerminalFormatter()) + "\n"
-                except ClassNotFound:
-                    return "\n" + code + "\n"
-
-        return re.sub(pattern, replace_code_block, text, flags=re.DOTALL)
-
-    @staticmethod
-    def enhance_text_formatting(text: str) -> str:
-        """Enhance text with additional formatting while preserving code blocks."""
-        # Store code blocks
-        code_blocks = {}
-        placeholder_pattern = 'CODE_BLOCK_PLACEHOLDER_{}'
-        triple_code_pattern = r'```(?:\w+)?\n.*?\n```'
-
-        def store_code_block(match):
-            placeholder = placeholder_pattern.format(len(code_blocks))
-            code_blocks[placeholder] = match.group(0)
-            return placeholder
-
-        text = re.sub(triple_code_pattern, store_code_block,
-                      text, flags=re.DOTALL)
-
-        # Format lists
-        text = TextFormatter._format_lists(text)
-
-        # Format inline elements
-        text = TextFormatter._format_inline_elements(text)
-
-        # Format headers
-        text = TextFormatter._format_headers(text)
+        formatted = [TextFormatter._format_prose(parts[0])]
+        for i in range(1, len(parts), 2):
+            formatted.append(TextFormatter._highlight_code(*parts[i]))
+            formatted.append(TextFormatter._format_prose(parts[i + 1]))
 
-        # Restore code blocks
-        for placeholder, code_block in code_blocks.items():
-            text = text.replace(placeholder, code_block)
-
-        return text
+        return ''.join(formatted)
 
     @staticmethod
-    def _format_lists(text: str) -> str:
-        """Format numbered lists and bullet points."""
-        # Numbered lists
-        number_pattern = r'^(\s*)(\d+\.)(\s+)(.+)$'
-
-        def number_replace(match):
-            indent, number, spacing, content = match.groups()
-            return f"{indent}{colored(number, 'yellow', attrs=['bold'])}{spacing}{colored(content, 'white')}"
-        text = re.sub(number_pattern, number_replace, text, flags=re.MULTILINE)
-
-        # Bullet points
-        bullet_pattern = r'^(\s*)[•\-\*](\s+)(.+)$'
+    def _highlight_code(language: str, code: str) -> str:
+        """Highlight a single code block using Pygments."""
+        pygments = _load_pygments()
+        try:
+            if language:
+                lexer = _lexer_by_name(language)
+            else:
+                lexer = _guess_lexer(code)
+            return "\n" + pygments.highlight(code, lexer, pygments.formatter) + "\n"
+        except pygments.ClassNotFound:
+            try:
+                lexer = _guess_lexer(code)
+                return "\n" + pygments.highlight(code, lexer, pygments.formatter) + "\n"
+            except pygments.ClassNotFound:
+                return "\n" + code + "\n"
 
-        def bullet_replace(match):
-            indent, spacing, content = match.groups()
-            bullet = colored('•', 'yellow')
-            return f"{indent}{colored(bullet, 'yellow', attrs=['bold'])}{spacing}{colored(content, 'white')}"
-        text = re.sub(bullet_pattern, bullet_replace, text, flags=re.MULTILINE)
+    @staticmethod
+    def _format_prose(text: str) -> str:
+        """Format lists, headers, and inline elements in text without code blocks."""
+        if not _MARKDOWN_HINT_RE.search(text):
+            return text
+        text = TextFormatter._format_lines(text)
+        return TextFormatter._format_inline_elements(text)
 
-        return text
+    @staticmethod
+    def _format_lines(text: str) -> str:
+        """Format numbered lists, bullet points, and headers."""
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            # Most lines are plain prose; only run the regex on likely candidates
+            if line.lstrip()[:1] not in _LINE_STARTS:
+                continue
+            match = _LINE_RE.match(line)
+            if match:
+                lines[i] = _replace_line(match)
+        return '\n'.join(lines)
 
     @staticmethod
     def _format_inline_elements(text: str) -> str:
         """Format inline code, bold text, italics, and URLs."""
-        # Inline code
-        text = re.sub(r'`([^`]+)`',
-                      lambda m: colored(m.group(1), 'green',
-                                        'on_grey', attrs=['bold']),
-                      text)
-
-        # Bold text
-        text = re.sub(r'\*\*([^*]+)\*\*',
-                      lambda m: colored(m.group(1), attrs=['bold']),
-                      text)
-
-        # Italics
-        text = re.sub(r'\*([^*]+)\*',
-                      lambda m: colored(m.group(1), attrs=['dark']),
-                      text)
-
-        # URLs
-        text = re.sub(r'\[([^\]]+)\]\(([^\)]+)\)',
-                      lambda m: colored(m.group(1), 'blue',
-                                        attrs=['underline']),
-                      text)
-
-        return text
-
-    @staticmethod
-    def _format_headers(text: str) -> str:
-        """Format markdown headers."""
-        return re.sub(r'^(#{1,6})\s+(.+)$',
-                      lambda m: '\n' +
-                      colored(m.group(2), 'white', attrs=[
-                              'bold', 'underline']) + '\n',
-                      text,
-                      flags=re.MULTILINE)
+        return _INLINE_RE.sub(_replace_inline, text)